@@ -1,20 +1,83 @@
 #!/usr/bin/env python3
 import asyncio
+import concurrent.futures
+import contextlib
 import dataclasses
+import errno
+import hashlib
 import json
+import multiprocessing
 import os
 import pathlib
+import secrets
 import shutil
 import sqlite3
+import sys
+import tarfile
 import tempfile
-import uuid
+import time
 import zipfile
+from concurrent.futures.process import BrokenProcessPool
 import httpx
 
 from datasette import hookimpl, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 from datasette.permissions import Action
 from datasette.database import Database
 
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 2
+# Report download progress at most this often (in bytes or seconds)
+PROGRESS_INTERVAL_BYTES = 4 * 1024 * 1024
+PROGRESS_INTERVAL_SECONDS = 0.25
+# Maximum number of chunks waiting to be written to disk, per download
+WRITE_QUEUE_SIZE = 8
+# Maximum number of chunks waiting to be written to disk across all downloads
+BUFFER_POOL_SIZE = 16
+# Files larger than this are downloaded using parallel Range requests
+PARALLEL_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+DEFAULT_DOWNLOAD_CONNECTIONS = 4
+# Reject archives that would extract to more than this multiple of their size
+MAX_EXTRACTION_RATIO = 5
+# Tar archives are streamed, so the first file with one of these is used
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+def install_uvloop():
+    """
+    Switch to the faster uvloop event loop, if it is installed and the
+    DATASETTE_LOAD_UVLOOP environment variable is set. This changes the
+    event loop policy for the whole process, so it is opt-in. It only
+    takes effect if no event loop is running yet, so it is called when the
+    plugin is loaded, before `datasette serve` starts its loop.
+    Event loop policies are deprecated from Python 3.14, so it does nothing
+    there.
+    """
+    if uvloop is None or not os.environ.get("DATASETTE_LOAD_UVLOOP"):
+        return
+    if sys.version_info >= (3, 14):
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+install_uvloop()
+
 
 # Configuration dataclass
 @dataclasses.dataclass
@@ -22,6 +85,26 @@ class Config:
     staging_directory: pathlib.Path
     database_directory: pathlib.Path
     enable_wal: bool
+    chunk_size: int
+    max_concurrent_downloads: int
+    download_connections: int
+    trusted_sha256: frozenset
+
+
+# Job status dataclass, returned as JSON by the API.
+# status is "queued" until a worker picks the job up, then "running", then "done"
+@dataclasses.dataclass(slots=True, kw_only=True)
+class Job:
+    id: str
+    url: str
+    name: str
+    status: str = "queued"
+    done: bool = False
+    error: str | None = None
+    todo_bytes: int = 0
+    done_bytes: int = 0
+    sha256: str | None = None
+    status_url: str
 
 
 @hookimpl
@@ -37,6 +120,46 @@ def skip_csrf(scope):
     return scope["path"] == "/-/load"
 
 
+@hookimpl
+def startup(datasette):
+    async def inner():
+        datasette._load_jobs = {}
+        datasette._load_status_prefix = datasette.urls.path("/-/load/status/")
+        # Limits memory used by chunks waiting to be written, across all jobs
+        datasette._load_buffer_slots = asyncio.Semaphore(BUFFER_POOL_SIZE)
+        cfg = config(datasette)
+        # Integrity checks are CPU heavy, so they run in separate processes
+        datasette._load_integrity_pool = create_integrity_pool(
+            cfg.max_concurrent_downloads
+        )
+        # One client is shared by all jobs so connections can be reused
+        datasette._load_client = create_client()
+        # Jobs are queued and processed by a fixed pool of workers
+        datasette._load_queue = asyncio.Queue()
+        datasette._load_workers = [
+            asyncio.create_task(load_worker(datasette))
+            for _ in range(cfg.max_concurrent_downloads)
+        ]
+
+    return inner
+
+
+@hookimpl
+def shutdown(datasette):
+    async def inner():
+        workers = getattr(datasette, "_load_workers", None)
+        if workers is None:
+            return
+        # Jobs still in progress or queued are abandoned
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await datasette._load_client.aclose()
+        datasette._load_integrity_pool.shutdown(wait=False, cancel_futures=True)
+
+    return inner
+
+
 @hookimpl
 def register_actions():
     return [
@@ -62,12 +185,54 @@ def homepage_actions(datasette, actor):
     return inner
 
 
+def create_client(http2=True):
+    """
+    Returns an httpx.AsyncClient configured for downloading large files.
+    """
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+        timeout=httpx.Timeout(60.0, read=300.0),
+    )
+
+
+def create_integrity_pool(max_workers):
+    """
+    Returns a process pool for running integrity checks in.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def json_loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def job_response(job):
+    """
+    Returns a JSON Response for a Job, serialized using orjson if available.
+    """
+    if orjson is not None:
+        body = orjson.dumps(job)
+    else:
+        body = json.dumps(dataclasses.asdict(job))
+    return Response(body, content_type="application/json; charset=utf-8")
+
+
 def config(datasette):
     """
     Return configuration settings.
     Expects plugin config to supply:
       - staging_directory: where to temporarily download files
       - database_directory: where final databases are stored
+      - chunk_size: minimum bytes to batch up per disk write
+      - max_concurrent_downloads: number of jobs processed at once
+      - download_connections: parallel Range requests used for large files
+      - trusted_sha256: SHA-256 digests of files that skip the integrity check
     """
     plugin_config = datasette.plugin_config("datasette-load") or {}
     return Config(
@@ -78,6 +243,17 @@ def config(datasette):
             plugin_config.get("database_directory") or "."
         ).absolute(),
         enable_wal=bool(plugin_config.get("enable_wal")),
+        chunk_size=int(plugin_config.get("chunk_size") or DEFAULT_CHUNK_SIZE),
+        max_concurrent_downloads=int(
+            plugin_config.get("max_concurrent_downloads")
+            or DEFAULT_MAX_CONCURRENT_DOWNLOADS
+        ),
+        download_connections=int(
+            plugin_config.get("download_connections") or DEFAULT_DOWNLOAD_CONNECTIONS
+        ),
+        trusted_sha256=frozenset(
+            digest.lower() for digest in plugin_config.get("trusted_sha256") or ()
+        ),
     )
 
 
@@ -86,6 +262,7 @@ async def load_view(request, datasette):
     Handles POST /-/load.
     Expected JSON body:
         {"url": "<database URL>", "name": "<database name>"}
+    Optional keys are "headers" and "sha256".
     """
     if not await datasette.allowed(actor=request.actor, action="datasette-load"):
         return Response.json(
@@ -98,42 +275,438 @@ async def load_view(request, datasette):
         )
 
     try:
-        data = json.loads(await request.post_body())
+        data = json_loads(await request.post_body())
     except Exception as e:
         return Response.json({"error": f"Invalid JSON: {e}"}, status=400)
 
     url = data.get("url")
     name = data.get("name")
     headers = data.get("headers")
+    expected_sha256 = data.get("sha256")
     if not url or not name:
         return Response.json(
             {"error": "Missing required parameters: url or name"}, status=400
         )
 
     # Create unique job id and a status record.
-    job_id = str(uuid.uuid4())
-    status_url = datasette.absolute_url(
-        request, datasette.urls.path(f"/-/load/status/{job_id}")
+    job_id = secrets.token_hex(16)
+    status_url = datasette.absolute_url(request, datasette._load_status_prefix + job_id)
+    job = Job(id=job_id, url=url, name=name, status_url=status_url)
+    datasette._load_jobs[job_id] = job
+
+    # Queue the job for processing by the next available worker.
+    datasette._load_queue.put_nowait(
+        (job, {"headers": headers, "expected_sha256": expected_sha256})
     )
-    job = {
-        "id": job_id,
-        "url": url,
-        "name": name,
-        "done": False,
-        "error": None,
-        "todo_bytes": 0,
-        "done_bytes": 0,
-        "status_url": status_url,
+    return job_response(job)
+
+
+async def load_worker(datasette):
+    """
+    Processes queued jobs one at a time, forever.
+    """
+    while True:
+        job, kwargs = await datasette._load_queue.get()
+        job.status = "running"
+        try:
+            await load_database_task(job, datasette, **kwargs)
+        finally:
+            datasette._load_queue.task_done()
+
+
+def write_chunk(f, chunk, hasher=None):
+    if hasher is not None:
+        hasher.update(chunk)
+    # f is unbuffered, so a single write() may not write the whole chunk
+    view = memoryview(chunk)
+    while view:
+        view = view[f.write(view) :]
+
+
+def write_buffers(f, buffers, hasher=None):
+    for buffer in buffers:
+        write_chunk(f, buffer, hasher)
+
+
+async def write_chunks(f, queue, hasher=None, buffer_slots=None, failed=None):
+    """
+    Writes lists of buffers from the queue to file f until a None sentinel
+    arrives, feeding them to the optional hashlib hasher as they are written.
+    If buffer_slots is provided, a slot is released for each list once it
+    has been written.
+    After a failed write the optional failed asyncio.Event is set so the
+    producer can stop early. The remaining chunks are drained and discarded,
+    so the producer never blocks, and the error is raised once the sentinel
+    has been received.
+    """
+    error = None
+    while (buffers := await queue.get()) is not None:
+        try:
+            if error is None:
+                await asyncio.to_thread(write_buffers, f, buffers, hasher)
+        except Exception as e:
+            error = e
+            if failed is not None:
+                failed.set()
+        finally:
+            if buffer_slots is not None:
+                buffer_slots.release()
+    if error is not None:
+        raise error
+
+
+async def batched_bytes(response, batch_size):
+    """
+    Yields the body of response as lists of the byte strings received from
+    the network, each list totalling at least batch_size bytes apart from the
+    last. Unlike response.aiter_bytes(batch_size) this never copies the data
+    into new chunks, and the lists can be written out in a single thread call.
+    """
+    batch = []
+    size = 0
+    async for data in response.aiter_bytes():
+        batch.append(data)
+        size += len(data)
+        if size >= batch_size:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def progress_reporter(progress_callback, total_bytes):
+    """
+    Returns an async function report(nbytes, final=False) which adds nbytes
+    to the running total and calls progress_callback at most every
+    PROGRESS_INTERVAL_BYTES or PROGRESS_INTERVAL_SECONDS, or if final is true.
+    """
+    bytes_so_far = 0
+    last_reported = 0
+    last_tick = time.monotonic()
+
+    async def report(nbytes, final=False):
+        nonlocal bytes_so_far, last_reported, last_tick
+        bytes_so_far += nbytes
+        now = time.monotonic()
+        if (
+            final
+            or bytes_so_far - last_reported >= PROGRESS_INTERVAL_BYTES
+            or now - last_tick >= PROGRESS_INTERVAL_SECONDS
+        ):
+            last_reported = bytes_so_far
+            last_tick = now
+            await progress_callback(bytes_so_far, total_bytes)
+
+    return report
+
+
+def advise(f, advice):
+    """
+    Tells the kernel how file f will be accessed, where advice is the name of
+    an os.POSIX_FADV_* constant. Does nothing on platforms without fadvise.
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice))
+
+
+def preallocate(f, size):
+    """
+    Reserves size bytes on disk for file f, so the filesystem can allocate
+    it contiguously rather than extending it chunk by chunk.
+    """
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError as ex:
+            # Fall back to truncate() if not supported by this filesystem,
+            # but let real failures such as running out of space through
+            if ex.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                raise
+    f.truncate(size)
+
+
+async def stream_to_file(
+    response, path, chunk_size, report_progress, total_bytes=0, buffer_slots=None
+):
+    """
+    Streams the body of response to path, returning its SHA-256 hex digest.
+    If the expected total_bytes is known the file is preallocated.
+    A slot from the buffer_slots semaphore is held by each chunk until it
+    has been written to disk.
+    """
+    if buffer_slots is None:
+        buffer_slots = asyncio.Semaphore(BUFFER_POOL_SIZE)
+    bytes_written = 0
+    # Chunks are already large, so skip Python's write buffer
+    with open(path, "wb", buffering=0) as f:
+        advise(f, "POSIX_FADV_SEQUENTIAL")
+        if total_bytes:
+            preallocate(f, total_bytes)
+        # Disk writes happen in a thread so they don't block the event loop;
+        # the bounded queue applies backpressure
+        queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+        hasher = hashlib.sha256()
+        failed = asyncio.Event()
+        writer = asyncio.create_task(
+            write_chunks(f, queue, hasher, buffer_slots, failed)
+        )
+        try:
+            async for buffers in batched_bytes(response, chunk_size):
+                if failed.is_set():
+                    # No point downloading the rest; the error is raised below
+                    break
+                await buffer_slots.acquire()
+                try:
+                    await queue.put(buffers)
+                except BaseException:
+                    buffer_slots.release()
+                    raise
+                size = sum(map(len, buffers))
+                bytes_written += size
+                await report_progress(size)
+        finally:
+            await queue.put(None)
+            await writer
+        # Content-Length may not match the decoded body size
+        if total_bytes != bytes_written:
+            f.truncate(bytes_written)
+    return hasher.hexdigest()
+
+
+def pwrite_buffers(fd, buffers, offset):
+    for buffer in buffers:
+        view = memoryview(buffer)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+
+
+async def download_range(
+    client,
+    url,
+    headers,
+    fd,
+    start,
+    end,
+    total_bytes,
+    chunk_size,
+    report_progress,
+    buffer_slots,
+    etag=None,
+):
+    """
+    Downloads bytes start to end (inclusive) of url, writing them to the
+    same offsets in the file open as fd. If etag is provided it is sent as
+    If-Range, so the server returns the whole file rather than a range from
+    a different version if it has changed, causing RangeNotSupported.
+    """
+    range_headers = {
+        **(headers or {}),
+        "Range": f"bytes={start}-{end}",
+        "Accept-Encoding": "identity",
     }
-    datasette._datasette_load_progress = getattr(
-        datasette, "_datasette_load_progress", {}
+    if etag:
+        range_headers["If-Range"] = etag
+    offset = start
+    async with client.stream("GET", url, headers=range_headers) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise RangeNotSupported(
+                f"Expected 206 response, got {response.status_code}"
+            )
+        content_range = response.headers.get("Content-Range", "")
+        if content_range.strip() != f"bytes {start}-{end}/{total_bytes}":
+            raise Exception(
+                f"Expected Content-Range for bytes {start}-{end}/{total_bytes}, "
+                f"got {content_range!r}"
+            )
+        async for buffers in batched_bytes(response, chunk_size):
+            size = sum(map(len, buffers))
+            if offset + size > end + 1:
+                raise Exception(f"Too much data returned for bytes {start}-{end}")
+            async with buffer_slots:
+                await asyncio.to_thread(pwrite_buffers, fd, buffers, offset)
+            offset += size
+            await report_progress(size)
+    if offset != end + 1:
+        raise Exception(f"Incomplete download of bytes {start}-{end}")
+
+
+async def download_ranges(
+    client,
+    url,
+    headers,
+    path,
+    total_bytes,
+    connections,
+    chunk_size,
+    report_progress,
+    buffer_slots=None,
+    etag=None,
+):
+    """
+    Downloads total_bytes from url to path by splitting it into connections
+    byte ranges and fetching them in parallel. Raises RangeNotSupported if
+    the server ignores the Range header, or if etag is provided and no
+    longer matches the file.
+    client should not use HTTP/2, which would multiplex every range over
+    a single TCP connection.
+    """
+    # If-Range requires a strong validator
+    if etag and etag.startswith("W/"):
+        etag = None
+    if buffer_slots is None:
+        buffer_slots = asyncio.Semaphore(BUFFER_POOL_SIZE)
+    part_size = -(-total_bytes // connections)
+    with open(path, "wb", buffering=0) as f:
+        preallocate(f, total_bytes)
+        tasks = [
+            asyncio.create_task(
+                download_range(
+                    client,
+                    url,
+                    headers,
+                    f.fileno(),
+                    start,
+                    min(start + part_size, total_bytes) - 1,
+                    total_bytes,
+                    chunk_size,
+                    report_progress,
+                    buffer_slots,
+                    etag,
+                )
+            )
+            for start in range(0, total_bytes, part_size)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # If one range failed, stop the others before closing the file
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def hash_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def extract_database(path, extracted_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    If the file at path is a zip or tar archive, extracts the SQLite database
+    from it to extracted_path and returns True. Returns False otherwise.
+    For zip files the largest file in the archive is used; tar files are read
+    as a stream and the first file with a SQLITE_EXTENSIONS suffix is used.
+    Sizes are checked before extracting against MAX_EXTRACTION_RATIO. For
+    tar files this applies to the total size of every member read so far,
+    as members before the database still have to be decompressed to skip
+    them.
+    """
+    archive_size = os.path.getsize(path)
+    max_size = archive_size * MAX_EXTRACTION_RATIO
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            # Find largest file in the zip
+            largest_file = max(zf.infolist(), key=lambda x: x.file_size)
+            if largest_file.file_size > max_size:
+                raise Exception(
+                    f"Extracted file would be more than {MAX_EXTRACTION_RATIO}x "
+                    "the size of the zip file"
+                )
+            with (
+                zf.open(largest_file.filename) as source,
+                open(extracted_path, "wb") as target,
+            ):
+                shutil.copyfileobj(source, target, chunk_size)
+        return True
+    if tarfile.is_tarfile(path):
+        total_size = 0
+        with tarfile.open(path, mode="r|*") as tf:
+            for member in tf:
+                total_size += member.size
+                if total_size > max_size:
+                    raise Exception(
+                        f"Extracted file would be more than {MAX_EXTRACTION_RATIO}x "
+                        "the size of the tar file"
+                    )
+                if not member.isfile() or not member.name.lower().endswith(
+                    SQLITE_EXTENSIONS
+                ):
+                    continue
+                with (
+                    tf.extractfile(member) as source,
+                    open(extracted_path, "wb") as target,
+                ):
+                    shutil.copyfileobj(source, target, chunk_size)
+                return True
+        raise Exception("No SQLite database file found in the tar file")
+    return False
+
+
+def run_integrity_check(path):
+    """
+    Runs PRAGMA integrity_check against the SQLite file at path, raising an
+    exception if it does not pass. This is slow for large files, so callers
+    should run it outside of the event loop.
+    """
+    conn = sqlite3.connect(str(path))
+    try:
+        # A 64MB page cache speeds up the check on large databases
+        conn.execute("PRAGMA cache_size=-65536;")
+        result = conn.execute("PRAGMA integrity_check;").fetchone()
+    finally:
+        conn.close()
+    if not result or result[0].lower() != "ok":
+        raise Exception(
+            f"Integrity check failed: {result[0] if result else 'No result returned.'}"
+        )
+
+
+def install_database(path, final_path, enable_wal):
+    """
+    Moves the verified database at path to final_path. It is first moved next
+    to final_path as a .partial file, which may involve a copy if the staging
+    directory is on another filesystem, and then renamed over final_path so
+    that path never refers to a missing or incomplete file. Each call uses
+    its own .partial file, so concurrent installs of the same name do not
+    interfere with each other.
+    """
+    partial_path = final_path.with_name(
+        f"{final_path.name}.{secrets.token_hex(8)}.partial"
     )
-    datasette._datasette_load_progress[job_id] = job
+    try:
+        shutil.move(str(path), str(partial_path))
+        if enable_wal:
+            conn = sqlite3.connect(str(partial_path))
+            conn.execute("PRAGMA journal_mode=wal;")
+            conn.close()
+        with open(partial_path, "r+b") as f:
+            os.fsync(f.fileno())
+        os.replace(partial_path, final_path)
+    except Exception:
+        if partial_path.exists():
+            os.remove(partial_path)
+        raise
 
-    # Launch the background processing task.
-    asyncio.create_task(load_database_task(job, datasette, headers=headers))
-    await asyncio.sleep(0.2)
-    return Response.json(job)
+
+def read_etag(etag_path, url):
+    """
+    Returns the ETag saved in etag_path if it was saved for url, else None.
+    """
+    try:
+        saved = json.loads(etag_path.read_text())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(saved, dict) or saved.get("url") != url:
+        return None
+    return saved.get("etag")
 
 
 async def download_sqlite_db(
@@ -145,110 +718,189 @@ async def download_sqlite_db(
     progress_callback,
     complete_callback,
     headers=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    expected_sha256=None,
+    client=None,
+    connections=DEFAULT_DOWNLOAD_CONNECTIONS,
+    integrity_pool=None,
+    buffer_slots=None,
+    trusted_sha256=(),
 ):
     """
-    Downloads an SQLite DB from the given URL into a temporary file in the staging directory.
-    The progress_callback is called as data arrives.
-    After download, the temporary file is verified with PRAGMA integrity_check.
+    Downloads an SQLite DB from the given URL into a temporary file in the
+    staging directory.
+    The progress_callback is called as data arrives, throttled to every
+    PROGRESS_INTERVAL_BYTES or PROGRESS_INTERVAL_SECONDS, and once at the end.
+    After download, the temporary file is verified with PRAGMA integrity_check,
+    run using the integrity_pool executor or a thread if that is None.
         • If the check fails, the temp file is deleted.
-        • If the check succeeds, the file is moved to database_dir/{name}.db.
-    The complete_callback is invoked with any error (or None if successful).
-    Optional headers can be supplied for the HTTP request.
+        • If the check succeeds, the file is moved to database_dir/{name}.db,
+          atomically replacing any existing file.
+    The SHA-256 of the downloaded file is computed as it is written (or
+    afterwards, for parallel downloads). If expected_sha256 is provided the
+    download must match it. The integrity check is only skipped if the
+    SHA-256 is one of the operator-configured trusted_sha256 digests.
+    The ETag of the download is saved, along with its URL, to
+    database_dir/{name}.db.etag and sent as If-None-Match when the same URL
+    is loaded again: if the server responds 304 Not Modified the existing
+    file is kept. This is skipped if expected_sha256 is provided, since the
+    existing file has not been checked against it.
+    The complete_callback is invoked with any error (or None if successful)
+    and the SHA-256 hex digest (or None if the download failed or was not
+    modified).
+    Optional headers can be supplied for the HTTP request, which is made
+    using client if provided or a new client from create_client() if not.
+    The response body is written to disk in batches of at least chunk_size bytes.
+    buffer_slots is an asyncio.Semaphore, shared between downloads, limiting
+    how many of those batches can be held in memory waiting to be written.
+    Files larger than PARALLEL_DOWNLOAD_THRESHOLD from servers that accept
+    Range requests are downloaded using connections parallel HTTP/1.1
+    connections, each fetching one byte range.
     """
     # Ensure the staging directory and final directory exist.
     staging_dir.mkdir(parents=True, exist_ok=True)
     database_dir.mkdir(parents=True, exist_ok=True)
 
     # Create a temporary file in the staging directory.
-    temp_filename = f"{name}-{uuid.uuid4().hex}.temp.db"
+    temp_filename = f"{name}-{secrets.token_hex(16)}.temp.db"
     temp_file_path = staging_dir / temp_filename
+    extracted_path = staging_dir / f"{name}-{secrets.token_hex(16)}.extracted.db"
+    final_db_path = database_dir / f"{name}.db"
+    etag_path = database_dir / f"{name}.db.etag"
     error = None
+    sha256 = None
+
+    # If we have a copy from a previous download, only fetch it if changed
+    request_headers = dict(headers or {})
+    if final_db_path.exists() and not expected_sha256:
+        previous_etag = read_etag(etag_path, url)
+        if previous_etag:
+            request_headers["If-None-Match"] = previous_etag
 
     try:
-        async with httpx.AsyncClient() as client:
-            async with client.stream("GET", url, headers=headers) as response:
+        async with contextlib.AsyncExitStack() as stack:
+            if client is None:
+                client = await stack.enter_async_context(create_client())
+            async with client.stream("GET", url, headers=request_headers) as response:
+                if response.status_code == 304:
+                    await complete_callback(name, database_dir, None, None)
+                    return
                 response.raise_for_status()
+                etag = response.headers.get("ETag")
                 content_length = response.headers.get("Content-Length")
                 total_bytes = (
                     int(content_length)
                     if content_length and content_length.isdigit()
                     else 0
                 )
-                bytes_so_far = 0
-
-                with open(temp_file_path, "wb") as f:
-                    async for chunk in response.aiter_bytes(8192):
-                        f.write(chunk)
-                        bytes_so_far += len(chunk)
-                        await progress_callback(bytes_so_far, total_bytes)
+                report_progress = progress_reporter(progress_callback, total_bytes)
+                use_ranges = (
+                    connections > 1
+                    and hasattr(os, "pwrite")
+                    and total_bytes > PARALLEL_DOWNLOAD_THRESHOLD
+                    and response.headers.get("Accept-Ranges", "").lower() == "bytes"
+                    and not response.headers.get("Content-Encoding")
+                )
+                if not use_ranges:
+                    sha256 = await stream_to_file(
+                        response,
+                        temp_file_path,
+                        chunk_size,
+                        report_progress,
+                        total_bytes,
+                        buffer_slots,
+                    )
 
-        # Check if file is a zip file
-        if zipfile.is_zipfile(temp_file_path):
-            try:
-                with zipfile.ZipFile(temp_file_path) as zf:
-                    zip_size = os.path.getsize(temp_file_path)
-                    # Find largest file in the zip
-                    largest_file = max(zf.infolist(), key=lambda x: x.file_size)
-                    if largest_file.file_size > zip_size * 5:
-                        raise Exception(
-                            "Extracted file would be more than 5x the size of the zip file"
+            if use_ranges:
+                # The first response is closed unread and the file is
+                # fetched as several byte ranges in parallel instead
+                try:
+                    # Each range needs its own TCP connection, so HTTP/2
+                    # multiplexing is avoided by using a separate client
+                    async with create_client(http2=False) as range_client:
+                        await download_ranges(
+                            range_client,
+                            url,
+                            headers,
+                            temp_file_path,
+                            total_bytes,
+                            connections,
+                            chunk_size,
+                            report_progress,
+                            buffer_slots,
+                            etag,
                         )
-
-                    # Extract largest file to a new temporary path
-                    extracted_path = (
-                        staging_dir / f"{name}-{uuid.uuid4().hex}.extracted.db"
+                    sha256 = await asyncio.to_thread(
+                        hash_file, temp_file_path, chunk_size
                     )
-                    with (
-                        zf.open(largest_file.filename) as source,
-                        open(extracted_path, "wb") as target,
-                    ):
-                        shutil.copyfileobj(source, target)
-
-                # Remove the zip file and use extracted file for further processing
-                os.remove(temp_file_path)
-                temp_file_path = extracted_path
-            except Exception as e:
-                if temp_file_path.exists():
-                    os.remove(temp_file_path)
-                raise e
+                except RangeNotSupported:
+                    report_progress = progress_reporter(progress_callback, total_bytes)
+                    async with client.stream("GET", url, headers=headers) as response:
+                        response.raise_for_status()
+                        sha256 = await stream_to_file(
+                            response,
+                            temp_file_path,
+                            chunk_size,
+                            report_progress,
+                            total_bytes,
+                            buffer_slots,
+                        )
+            await report_progress(0, final=True)
+
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            raise Exception(
+                f"SHA-256 mismatch: expected {expected_sha256}, got {sha256}"
+            )
+
+        # If the file is a zip or tar archive, extract the database from it
+        if await asyncio.to_thread(
+            extract_database, temp_file_path, extracted_path, chunk_size
+        ):
+            # Remove the archive and use extracted file for further processing
+            os.remove(temp_file_path)
+            temp_file_path = extracted_path
 
-        # Run PRAGMA integrity_check on the file
+        # Run PRAGMA integrity_check, unless the file is on the trusted list
         try:
-            conn = sqlite3.connect(str(temp_file_path))
-            cursor = conn.cursor()
-            cursor.execute("PRAGMA integrity_check;")
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            if not result or result[0].lower() != "ok":
-                raise Exception(
-                    f"Integrity check failed: {result[0] if result else 'No result returned.'}"
-                )
+            if sha256 not in trusted_sha256:
+                with open(temp_file_path, "rb") as f:
+                    # Start reading ahead now, and evict the file from the
+                    # page cache once checked to avoid displacing other data
+                    advise(f, "POSIX_FADV_WILLNEED")
+                    try:
+                        await asyncio.get_running_loop().run_in_executor(
+                            integrity_pool, run_integrity_check, temp_file_path
+                        )
+                    except BrokenProcessPool as ex:
+                        raise BrokenProcessPool(f"Integrity check failed: {ex}") from ex
+                    finally:
+                        advise(f, "POSIX_FADV_DONTNEED")
         except Exception as integrity_error:
             error = integrity_error
-            if temp_file_path.exists():
-                os.remove(temp_file_path)
 
         # If integrity check succeeded, move file to final database directory.
         if not error:
-            final_db_path = database_dir / f"{name}.db"
-            if final_db_path.exists():
-                os.remove(final_db_path)
-            shutil.move(str(temp_file_path), str(final_db_path))
-            if enable_wal:
-                conn = sqlite3.connect(str(final_db_path))
-                conn.execute("PRAGMA journal_mode=wal;")
-                conn.close()
+            await asyncio.to_thread(
+                install_database, temp_file_path, final_db_path, enable_wal
+            )
+            if etag:
+                etag_path.write_text(json.dumps({"url": url, "etag": etag}))
+            elif etag_path.exists():
+                os.remove(etag_path)
 
     except Exception as download_error:
         error = download_error
-        if temp_file_path.exists():
-            os.remove(temp_file_path)
+        sha256 = None
+    finally:
+        # Also runs if the job is cancelled, so no staging files are left
+        for path in (temp_file_path, extracted_path):
+            if path.exists():
+                os.remove(path)
 
-    await complete_callback(name, database_dir, error)
+    await complete_callback(name, database_dir, error, sha256)
 
 
-async def load_database_task(job, datasette, headers=None):
+async def load_database_task(job, datasette, headers=None, expected_sha256=None):
     """
     Downloads and installs the SQLite DB as described in the job.
     Uses config(datasette) for staging and final database directories.
@@ -257,15 +909,26 @@ async def load_database_task(job, datasette, headers=None):
     """
     try:
         cfg = config(datasette)
+        integrity_pool = datasette._load_integrity_pool
 
         async def progress_callback(bytes_so_far, total_bytes):
-            job["todo_bytes"] = total_bytes
-            job["done_bytes"] = bytes_so_far
-
-        async def complete_callback(name, database_directory, error):
+            job.todo_bytes = total_bytes
+            job.done_bytes = bytes_so_far
+
+        async def complete_callback(name, database_directory, error, sha256):
+            job.sha256 = sha256
+            if isinstance(error, BrokenProcessPool):
+                # A worker process died, which leaves the pool unusable, so
+                # replace it unless another job has already done so
+                if datasette._load_integrity_pool is integrity_pool:
+                    datasette._load_integrity_pool = create_integrity_pool(
+                        cfg.max_concurrent_downloads
+                    )
+                    integrity_pool.shutdown(wait=False, cancel_futures=True)
             if error:
-                job["error"] = str(error)
-                job["done"] = True
+                job.error = str(error)
+                job.done = True
+                job.status = "done"
                 return
 
             try:
@@ -278,24 +941,34 @@ async def load_database_task(job, datasette, headers=None):
                     Database(datasette, path=str(final_db_path)),
                     name=name,
                 )
-                job["done"] = True
+                job.done = True
+                job.status = "done"
             except Exception as e:
-                job["error"] = f"Error installing database: {str(e)}"
-                job["done"] = True
+                job.error = f"Error installing database: {str(e)}"
+                job.done = True
+                job.status = "done"
 
         await download_sqlite_db(
-            url=job["url"],
-            name=job["name"],
+            url=job.url,
+            name=job.name,
             staging_dir=cfg.staging_directory,
             database_dir=cfg.database_directory,
             enable_wal=cfg.enable_wal,
             progress_callback=progress_callback,
             complete_callback=complete_callback,
             headers=headers,
+            chunk_size=cfg.chunk_size,
+            expected_sha256=expected_sha256,
+            trusted_sha256=cfg.trusted_sha256,
+            client=datasette._load_client,
+            connections=cfg.download_connections,
+            integrity_pool=integrity_pool,
+            buffer_slots=datasette._load_buffer_slots,
         )
     except Exception as e:
-        job["error"] = f"Error initiating download: {str(e)}"
-        job["done"] = True
+        job.error = f"Error initiating download: {str(e)}"
+        job.done = True
+        job.status = "done"
 
 
 async def load_status_api(request, datasette):
@@ -303,10 +976,7 @@ async def load_status_api(request, datasette):
     Handles GET /-/load/status/<job_id> and returns a JSON record for the job.
     """
     job_id = request.url_vars["job_id"]
-    datasette._datasette_load_progress = getattr(
-        datasette, "_datasette_load_progress", {}
-    )
-    job = datasette._datasette_load_progress.get(job_id)
+    job = datasette._load_jobs.get(job_id)
     if job is None:
         return Response.json({"error": "Job not found"}, status=404)
-    return Response.json(job)
+    return job_response(job)
@@ -1,15 +1,31 @@
 import asyncio
+import concurrent.futures
+import errno
+import hashlib
+import json
 from datasette.app import Datasette
 import pytest
 import sqlite_utils
 import httpx
+import io
 import os
 import pathlib
+import tarfile
 import tempfile
+import threading
 import zipfile
 
+import datasette_load
+from datasette_load import download_sqlite_db, write_chunk, write_chunks
 
-def create_datasette(db_path=None, enable_wal=None):
+
+def create_datasette(
+    db_path=None,
+    enable_wal=None,
+    chunk_size=None,
+    max_concurrent_downloads=None,
+    settings=None,
+):
     files = []
     if db_path:
         files = [db_path]
@@ -20,9 +36,14 @@ def create_datasette(db_path=None, enable_wal=None):
     }
     if enable_wal is not None:
         options["enable_wal"] = enable_wal
+    if chunk_size is not None:
+        options["chunk_size"] = chunk_size
+    if max_concurrent_downloads is not None:
+        options["max_concurrent_downloads"] = max_concurrent_downloads
     datasette = Datasette(
         files=files,
         memory=True,
+        settings=settings,
         config={
             "permissions": {"datasette-load": {"id": "user"}},
             "plugins": {"datasette-load": options},
@@ -42,6 +63,14 @@ def create_temp_sqlite_db(tables_data):
     return db_path
 
 
+async def wait_until_done(datasette, job_id):
+    while True:
+        status_data = (await datasette.client.get(f"/-/load/status/{job_id}")).json()
+        if status_data["done"]:
+            return status_data
+        await asyncio.sleep(0.1)
+
+
 @pytest.fixture
 def non_mocked_hosts():
     # This ensures httpx doesn't mock external calls
@@ -307,7 +336,7 @@ async def test_database_removed_if_exists(httpx_mock):
 
     assert response.status_code == 200
     job_id = response.json()["id"]
-    assert datasette._datasette_load_progress[job_id]
+    assert datasette._load_jobs[job_id]
 
     status_url = response.json()["status_url"].split("localhost")[1]
 
@@ -348,29 +377,59 @@ async def test_replace_database(httpx_mock):
     await datasette.invoke_startup()
 
     # Load first database
-    assert (
-        await datasette.client.post(
-            "/-/load",
-            json={"url": db_uri1, "name": "data"},
-            cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
-        )
-    ).status_code == 200
-    await asyncio.sleep(0.1)
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": db_uri1, "name": "data"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    assert response.status_code == 200
+    await wait_until_done(datasette, response.json()["id"])
     data1 = (await datasette.client.get("/data/test_table.json?_shape=array")).json()
     assert data1 == [{"data": "exists", "id": 1}]
 
     # Load the second one to replace it
-    assert (
-        await datasette.client.post(
-            "/-/load",
-            json={"url": db_uri2, "name": "data"},
-            cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
-        )
-    ).status_code == 200
-    await asyncio.sleep(0.1)
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": db_uri2, "name": "data"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    assert response.status_code == 200
+    await wait_until_done(datasette, response.json()["id"])
     data1 = (await datasette.client.get("/data/test_table.json?_shape=array")).json()
     assert data1 == [{"data": "exists", "id": 2}]
 
+    # The file was swapped into place, leaving no partial files behind
+    path = datasette.plugin_config("datasette-load")["database_directory"]
+    assert [p.name for p in pathlib.Path(path).iterdir()] == ["data.db"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_installs_of_same_name(monkeypatch, tmp_path):
+    final_path = tmp_path / "data.db"
+    contents = []
+    paths = []
+    for i in range(2):
+        path = pathlib.Path(create_temp_sqlite_db({"test_table": [{"id": i}]}))
+        contents.append(path.read_bytes())
+        paths.append(path)
+    # Ensure both installs have moved their file before either replaces
+    barrier = threading.Barrier(2, timeout=5)
+    fsync = os.fsync
+
+    def waiting_fsync(fd):
+        barrier.wait()
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", waiting_fsync)
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(datasette_load.install_database, path, final_path, False)
+            for path in paths
+        )
+    )
+    assert final_path.read_bytes() in contents
+    assert [p.name for p in tmp_path.iterdir()] == ["data.db"]
+
 
 @pytest.mark.asyncio
 async def test_load_endpoint_html():
@@ -412,13 +471,13 @@ async def test_enable_wal(httpx_mock, enable_wal):
     await datasette.invoke_startup()
 
     # Load first database
-    assert (
-        await datasette.client.post(
-            "/-/load",
-            json={"url": db_url, "name": "data"},
-            cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
-        )
-    ).status_code == 200
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": db_url, "name": "data"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    assert response.status_code == 200
+    await wait_until_done(datasette, response.json()["id"])
 
     # check if enable-wal is on or off
     final_db_path = next(
@@ -527,3 +586,775 @@ async def test_load_from_zip_compression_bomb(httpx_mock, tmp_path):
 
     assert "would be more than 5x the size" in status_data["error"]
     assert "from_zip" not in datasette.databases
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", (None, 512))
+async def test_chunk_size(httpx_mock, chunk_size):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1, "data": "exists"}]})
+    db_url = "https://example.com/data.db"
+    db_size = os.path.getsize(db_path)
+    httpx_mock.add_response(
+        url=db_url,
+        content=open(db_path, "rb").read(),
+        headers={"Content-Length": str(db_size)},
+    )
+    datasette = create_datasette(chunk_size=chunk_size)
+
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": db_url, "name": "data"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    assert response.status_code == 200
+    status_data = await wait_until_done(datasette, response.json()["id"])
+
+    assert status_data["error"] is None
+    assert status_data["done_bytes"] == db_size
+    assert status_data["todo_bytes"] == db_size
+    result = await datasette.get_database("data").execute("select * from test_table")
+    assert len(result.rows) == 1
+
+
+@pytest.mark.asyncio
+async def test_progress_callback_throttled(httpx_mock, tmp_path):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1, "data": "exists"}]})
+    db_url = "https://example.com/data.db"
+    db_size = os.path.getsize(db_path)
+    httpx_mock.add_response(
+        url=db_url,
+        content=open(db_path, "rb").read(),
+        headers={"Content-Length": str(db_size)},
+    )
+    progress = []
+    errors = []
+
+    async def progress_callback(bytes_so_far, total_bytes):
+        progress.append((bytes_so_far, total_bytes))
+
+    async def complete_callback(name, database_dir, error, sha256):
+        errors.append(error)
+
+    await download_sqlite_db(
+        url=db_url,
+        name="data",
+        staging_dir=tmp_path / "staging",
+        database_dir=tmp_path / "database",
+        enable_wal=False,
+        progress_callback=progress_callback,
+        complete_callback=complete_callback,
+        chunk_size=64,
+    )
+    assert errors == [None]
+    # Far fewer updates than chunks, always ending with the final total
+    assert len(progress) < db_size // 64
+    assert progress[-1] == (db_size, db_size)
+
+
+@pytest.mark.asyncio
+async def test_write_chunks_error_does_not_block_producer():
+    class BrokenFile:
+        def write(self, chunk):
+            raise OSError("Disk full")
+
+    queue = asyncio.Queue(maxsize=2)
+    buffer_slots = asyncio.Semaphore(3)
+    writer = asyncio.create_task(
+        write_chunks(BrokenFile(), queue, buffer_slots=buffer_slots)
+    )
+    for _ in range(10):
+        await asyncio.wait_for(buffer_slots.acquire(), timeout=1)
+        await asyncio.wait_for(queue.put([b"x"]), timeout=1)
+    await queue.put(None)
+    with pytest.raises(OSError, match="Disk full"):
+        await writer
+    # Every slot was released, even though the writes failed
+    for _ in range(3):
+        await asyncio.wait_for(buffer_slots.acquire(), timeout=1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("expected", (None, "match", "mismatch"))
+async def test_load_sha256(httpx_mock, expected):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1, "data": "exists"}]})
+    db_url = "https://example.com/data.db"
+    db_content = open(db_path, "rb").read()
+    sha256 = hashlib.sha256(db_content).hexdigest()
+    httpx_mock.add_response(
+        url=db_url,
+        content=db_content,
+        headers={"Content-Length": str(len(db_content))},
+    )
+    datasette = create_datasette()
+
+    body = {"url": db_url, "name": "data"}
+    if expected == "match":
+        body["sha256"] = sha256.upper()
+    elif expected == "mismatch":
+        body["sha256"] = "0" * 64
+    response = await datasette.client.post(
+        "/-/load",
+        json=body,
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    assert response.status_code == 200
+    status_data = await wait_until_done(datasette, response.json()["id"])
+
+    if expected == "mismatch":
+        assert "SHA-256 mismatch" in status_data["error"]
+        assert status_data["sha256"] is None
+        assert "data" not in datasette.databases
+    else:
+        assert status_data["error"] is None
+        assert status_data["sha256"] == sha256
+        assert "data" in datasette.databases
+
+
+@pytest.mark.asyncio
+async def test_matching_sha256_still_runs_integrity_check(httpx_mock):
+    content = b"not a sqlite database" * 100
+    db_url = "https://example.com/data.db"
+    httpx_mock.add_response(url=db_url, content=content)
+    datasette = create_datasette()
+
+    response = await datasette.client.post(
+        "/-/load",
+        json={
+            "url": db_url,
+            "name": "data",
+            "sha256": hashlib.sha256(content).hexdigest(),
+        },
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    status_data = await wait_until_done(datasette, response.json()["id"])
+    assert "file is not a database" in status_data["error"]
+    assert "data" not in datasette.databases
+
+
+@pytest.mark.asyncio
+async def test_integrity_pool_replaced_after_worker_crash(httpx_mock):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1}]})
+    db_url = "https://example.com/data.db"
+    httpx_mock.add_response(
+        url=db_url, content=open(db_path, "rb").read(), is_reusable=True
+    )
+    datasette = create_datasette()
+    await datasette.invoke_startup()
+    # Kill a worker process, which breaks the pool
+    broken_pool = datasette._load_integrity_pool
+    with pytest.raises(concurrent.futures.process.BrokenProcessPool):
+        broken_pool.submit(os._exit, 1).result()
+
+    async def load():
+        response = await datasette.client.post(
+            "/-/load",
+            json={"url": db_url, "name": "data"},
+            cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+        )
+        return await wait_until_done(datasette, response.json()["id"])
+
+    status_data = await load()
+    assert status_data["error"].startswith("Integrity check failed")
+    assert "data" not in datasette.databases
+    assert datasette._load_integrity_pool is not broken_pool
+
+    # The next job uses the replacement pool
+    status_data = await load()
+    assert status_data["error"] is None
+    assert "data" in datasette.databases
+
+
+@pytest.mark.asyncio
+async def test_integrity_check_without_pool(httpx_mock, tmp_path):
+    db_url = "https://example.com/data.db"
+    httpx_mock.add_response(url=db_url, content=b"not a database" * 100)
+    errors = []
+
+    async def progress_callback(bytes_so_far, total_bytes):
+        pass
+
+    async def complete_callback(name, database_dir, error, sha256):
+        errors.append(error)
+
+    await download_sqlite_db(
+        url=db_url,
+        name="data",
+        staging_dir=tmp_path / "staging",
+        database_dir=tmp_path / "database",
+        enable_wal=False,
+        progress_callback=progress_callback,
+        complete_callback=complete_callback,
+    )
+    assert len(errors) == 1
+    assert "file is not a database" in str(errors[0])
+    assert not list((tmp_path / "staging").iterdir())
+
+
+@pytest.mark.asyncio
+async def test_trusted_sha256_skips_integrity_check(httpx_mock, tmp_path):
+    # Only passes because the integrity check is skipped
+    content = b"not a sqlite database" * 100
+    db_url = "https://example.com/data.db"
+    httpx_mock.add_response(url=db_url, content=content)
+    errors = []
+
+    async def progress_callback(bytes_so_far, total_bytes):
+        pass
+
+    async def complete_callback(name, database_dir, error, sha256):
+        errors.append(error)
+
+    await download_sqlite_db(
+        url=db_url,
+        name="data",
+        staging_dir=tmp_path / "staging",
+        database_dir=tmp_path / "database",
+        enable_wal=False,
+        progress_callback=progress_callback,
+        complete_callback=complete_callback,
+        trusted_sha256={hashlib.sha256(content).hexdigest()},
+    )
+    assert errors == [None]
+    assert (tmp_path / "database" / "data.db").read_bytes() == content
+
+
+@pytest.mark.asyncio
+async def test_max_concurrent_downloads(httpx_mock):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1, "data": "exists"}]})
+    db_content = open(db_path, "rb").read()
+    for i in range(3):
+        httpx_mock.add_response(
+            url=f"https://example.com/data{i}.db",
+            content=db_content,
+            headers={"Content-Length": str(len(db_content))},
+        )
+    datasette = create_datasette(max_concurrent_downloads=1)
+    await datasette.invoke_startup()
+    assert len(datasette._load_workers) == 1
+
+    job_ids = []
+    for i in range(3):
+        response = await datasette.client.post(
+            "/-/load",
+            json={"url": f"https://example.com/data{i}.db", "name": f"data{i}"},
+            cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+        )
+        assert response.status_code == 200
+        assert response.json()["done"] is False
+        assert response.json()["status"] == "queued"
+        job_ids.append(response.json()["id"])
+
+    for i, job_id in enumerate(job_ids):
+        status_data = await wait_until_done(datasette, job_id)
+        assert status_data["error"] is None
+        assert status_data["status"] == "done"
+        assert f"data{i}" in datasette.databases
+
+
+def test_write_chunk_handles_short_writes():
+    class ShortWriteFile:
+        def __init__(self):
+            self.written = b""
+
+        def write(self, data):
+            # Raw files can write fewer bytes than requested
+            self.written += bytes(data[:3])
+            return min(len(data), 3)
+
+    f = ShortWriteFile()
+    hasher = hashlib.sha256()
+    write_chunk(f, b"0123456789", hasher)
+    assert f.written == b"0123456789"
+    assert hasher.hexdigest() == hashlib.sha256(b"0123456789").hexdigest()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "mode", ("ranges", "no_ranges", "changed_during_download", "bad_content_range")
+)
+async def test_parallel_range_download(httpx_mock, monkeypatch, mode):
+    monkeypatch.setattr(datasette_load, "PARALLEL_DOWNLOAD_THRESHOLD", 1024)
+    db_path = create_temp_sqlite_db(
+        {"test_table": [{"id": i, "name": "x" * 100} for i in range(100)]}
+    )
+    db_url = "https://example.com/data.db"
+    db_content = open(db_path, "rb").read()
+    etags = iter(['"v1"'] + ['"v2"' if mode == "changed_during_download" else '"v1"'])
+    current_etag = None
+    range_requests = []
+
+    def serve(request):
+        nonlocal current_etag
+        range_header = request.headers.get("Range")
+        if range_header and mode != "no_ranges":
+            range_requests.append(request)
+            if request.headers.get("If-Range") == current_etag:
+                start, end = map(int, range_header.split("=")[1].split("-"))
+                if mode == "bad_content_range":
+                    start, end = 0, end - start
+                return httpx.Response(
+                    206,
+                    content=db_content[start : end + 1],
+                    headers={
+                        "Content-Length": str(end + 1 - start),
+                        "Content-Range": f"bytes {start}-{end}/{len(db_content)}",
+                    },
+                )
+        current_etag = next(etags, current_etag)
+        return httpx.Response(
+            200,
+            content=db_content,
+            headers={
+                "Content-Length": str(len(db_content)),
+                "Accept-Ranges": "bytes",
+                "ETag": current_etag,
+            },
+        )
+
+    httpx_mock.add_callback(serve, url=db_url, is_reusable=True)
+    created_clients = []
+    create_client = datasette_load.create_client
+
+    def recording_create_client(http2=True):
+        created_clients.append(http2)
+        return create_client(http2=http2)
+
+    monkeypatch.setattr(datasette_load, "create_client", recording_create_client)
+    datasette = create_datasette()
+
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": db_url, "name": "data"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    status_data = await wait_until_done(datasette, response.json()["id"])
+
+    if mode == "bad_content_range":
+        assert "Expected Content-Range for bytes" in status_data["error"]
+        return
+    assert status_data["error"] is None
+    assert status_data["done_bytes"] == len(db_content)
+    assert status_data["sha256"] == hashlib.sha256(db_content).hexdigest()
+    if mode != "no_ranges":
+        assert len(range_requests) == datasette_load.DEFAULT_DOWNLOAD_CONNECTIONS
+        # Ranges must come from the version of the file that was probed
+        assert {r.headers["If-Range"] for r in range_requests} == {'"v1"'}
+        # Ranges use their own HTTP/1.1 connections, not the shared HTTP/2 client
+        assert created_clients == [True, False]
+    # All shared buffer slots have been returned to the pool
+    for _ in range(datasette_load.BUFFER_POOL_SIZE):
+        await asyncio.wait_for(datasette._load_buffer_slots.acquire(), timeout=1)
+    result = await datasette.get_database("data").execute("select * from test_table")
+    assert len(result.rows) == 100
+
+
+@pytest.mark.asyncio
+async def test_preallocated_file_truncated_to_body_size(httpx_mock, tmp_path):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1, "data": "exists"}]})
+    db_url = "https://example.com/data.db"
+    db_content = open(db_path, "rb").read()
+    # Content-Length overstates the size of the body
+    httpx_mock.add_response(
+        url=db_url,
+        content=db_content,
+        headers={"Content-Length": str(len(db_content) + 4096)},
+    )
+    errors = []
+
+    async def progress_callback(bytes_so_far, total_bytes):
+        pass
+
+    async def complete_callback(name, database_dir, error, sha256):
+        errors.append(error)
+
+    await download_sqlite_db(
+        url=db_url,
+        name="data",
+        staging_dir=tmp_path / "staging",
+        database_dir=tmp_path / "database",
+        enable_wal=False,
+        progress_callback=progress_callback,
+        complete_callback=complete_callback,
+    )
+    assert errors == [None]
+    assert (tmp_path / "database" / "data.db").read_bytes() == db_content
+
+
+@pytest.mark.parametrize(
+    "error,should_raise",
+    ((errno.EOPNOTSUPP, False), (errno.EINVAL, False), (errno.ENOSPC, True)),
+)
+def test_preallocate_fallback(monkeypatch, tmp_path, error, should_raise):
+    def posix_fallocate(fd, offset, length):
+        raise OSError(error, os.strerror(error))
+
+    monkeypatch.setattr(os, "posix_fallocate", posix_fallocate, raising=False)
+    with open(tmp_path / "file", "wb") as f:
+        if should_raise:
+            with pytest.raises(OSError) as ex:
+                datasette_load.preallocate(f, 1024)
+            assert ex.value.errno == error
+        else:
+            datasette_load.preallocate(f, 1024)
+    assert (tmp_path / "file").stat().st_size == (0 if should_raise else 1024)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_orjson", (True, False))
+async def test_job_json_with_and_without_orjson(httpx_mock, monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(datasette_load, "orjson", None)
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1, "data": "exists"}]})
+    db_url = "https://example.com/data.db"
+    httpx_mock.add_response(url=db_url, content=open(db_path, "rb").read())
+    datasette = create_datasette()
+
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": db_url, "name": "data"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json; charset=utf-8"
+    job = response.json()
+    assert list(job.keys()) == [
+        "id",
+        "url",
+        "name",
+        "status",
+        "done",
+        "error",
+        "todo_bytes",
+        "done_bytes",
+        "sha256",
+        "status_url",
+    ]
+    status_data = await wait_until_done(datasette, job["id"])
+    assert status_data["error"] is None
+
+
+@pytest.mark.asyncio
+async def test_batched_bytes():
+    async def stream():
+        for piece in (b"ab", b"cde", b"f", b"ghij", b"k"):
+            yield piece
+
+    response = httpx.Response(200, content=stream())
+    batches = [batch async for batch in datasette_load.batched_bytes(response, 4)]
+    # Pieces are passed through as-is rather than re-chunked
+    assert batches == [[b"ab", b"cde"], [b"f", b"ghij"], [b"k"]]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "member_name,compressible,expected_error",
+    (
+        ("data/test.db", False, None),
+        ("test.sqlite", True, "would be more than 5x the size of the tar file"),
+        ("test.txt", False, "No SQLite database file found in the tar file"),
+    ),
+)
+async def test_load_from_tar_gz(
+    httpx_mock, tmp_path, member_name, compressible, expected_error
+):
+    datasette = create_datasette()
+    if compressible:
+        rows = [{"id": i, "name": "x" * 1000} for i in range(1000)]
+    else:
+        rows = [{"id": i, "name": os.urandom(500).hex()} for i in range(100)]
+    db_path = create_temp_sqlite_db({"test_table": rows})
+    tar_path = os.path.join(tmp_path, "database.tar.gz")
+    with tarfile.open(tar_path, "w:gz") as tf:
+        tf.add(db_path, member_name)
+
+    tar_url = "https://example.com/database.tar.gz"
+    with open(tar_path, "rb") as f:
+        tar_content = f.read()
+    httpx_mock.add_response(
+        url=tar_url,
+        content=tar_content,
+        headers={"Content-Length": str(len(tar_content))},
+    )
+
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": tar_url, "name": "from_tar"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    assert response.status_code == 200
+    status_data = await wait_until_done(datasette, response.json()["id"])
+
+    if expected_error:
+        assert expected_error in status_data["error"]
+        assert "from_tar" not in datasette.databases
+    else:
+        assert status_data["error"] is None
+        db = datasette.get_database("from_tar")
+        result = await db.execute("SELECT count(*) FROM test_table")
+        assert result.single_value() == len(rows)
+    # Nothing should be left behind in the staging directory
+    staging = datasette.plugin_config("datasette-load")["staging_directory"]
+    assert not list(pathlib.Path(staging).glob("*"))
+
+
+def test_tar_size_limit_includes_skipped_members(tmp_path):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1}]})
+    tar_path = tmp_path / "database.tar.gz"
+    with tarfile.open(tar_path, "w:gz") as tf:
+        # Compresses to a tiny fraction of its size, ahead of the database
+        junk = tarfile.TarInfo("junk.bin")
+        junk.size = 10 * 1024 * 1024
+        tf.addfile(junk, io.BytesIO(b"\0" * junk.size))
+        tf.add(db_path, "test.db")
+    extracted_path = tmp_path / "extracted.db"
+    with pytest.raises(Exception, match="would be more than 5x the size of the tar"):
+        datasette_load.extract_database(tar_path, extracted_path)
+    assert not extracted_path.exists()
+
+
+class FakeUvloop:
+    class EventLoopPolicy:
+        pass
+
+
+@pytest.mark.parametrize(
+    "env,version_info,expected",
+    (
+        ("1", (3, 13), True),
+        (None, (3, 13), False),
+        ("1", (3, 14), False),
+    ),
+)
+def test_install_uvloop(monkeypatch, env, version_info, expected):
+    policies = []
+    monkeypatch.setattr(datasette_load, "uvloop", FakeUvloop)
+    monkeypatch.setattr(asyncio, "set_event_loop_policy", policies.append)
+    monkeypatch.setattr(datasette_load.sys, "version_info", version_info)
+    if env is None:
+        monkeypatch.delenv("DATASETTE_LOAD_UVLOOP", raising=False)
+    else:
+        monkeypatch.setenv("DATASETTE_LOAD_UVLOOP", env)
+    datasette_load.install_uvloop()
+    if expected:
+        assert len(policies) == 1
+        assert isinstance(policies[0], FakeUvloop.EventLoopPolicy)
+    else:
+        assert not policies
+
+
+@pytest.mark.asyncio
+async def test_install_uvloop_ignored_if_loop_running(monkeypatch):
+    policies = []
+    monkeypatch.setattr(datasette_load, "uvloop", FakeUvloop)
+    monkeypatch.setattr(asyncio, "set_event_loop_policy", policies.append)
+    monkeypatch.setattr(datasette_load.sys, "version_info", (3, 13))
+    monkeypatch.setenv("DATASETTE_LOAD_UVLOOP", "1")
+    datasette_load.install_uvloop()
+    assert not policies
+
+
+@pytest.mark.asyncio
+async def test_status_url_respects_base_url(httpx_mock):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1}]})
+    db_url = "https://example.com/data.db"
+    httpx_mock.add_response(url=db_url, content=open(db_path, "rb").read())
+    datasette = create_datasette(settings={"base_url": "/prefix/"})
+
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": db_url, "name": "data"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    assert response.status_code == 200
+    job_id = response.json()["id"]
+    assert (
+        response.json()["status_url"]
+        == f"http://localhost/prefix/-/load/status/{job_id}"
+    )
+    await wait_until_done(datasette, job_id)
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(
+    not hasattr(os, "posix_fadvise"), reason="posix_fadvise not available"
+)
+async def test_fadvise_hints(httpx_mock, monkeypatch):
+    advice = []
+    monkeypatch.setattr(
+        os, "posix_fadvise", lambda fd, offset, length, a: advice.append(a)
+    )
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1}]})
+    db_url = "https://example.com/data.db"
+    httpx_mock.add_response(url=db_url, content=open(db_path, "rb").read())
+    datasette = create_datasette()
+
+    response = await datasette.client.post(
+        "/-/load",
+        json={"url": db_url, "name": "data"},
+        cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+    )
+    status_data = await wait_until_done(datasette, response.json()["id"])
+    assert status_data["error"] is None
+    assert advice == [
+        os.POSIX_FADV_SEQUENTIAL,
+        os.POSIX_FADV_WILLNEED,
+        os.POSIX_FADV_DONTNEED,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_not_modified_skips_download(httpx_mock):
+    db_path = create_temp_sqlite_db({"test_table": [{"id": 1}]})
+    db_url = "https://example.com/data.db"
+    httpx_mock.add_response(
+        url=db_url, content=open(db_path, "rb").read(), headers={"ETag": '"v1"'}
+    )
+    httpx_mock.add_response(
+        url=db_url, status_code=304, match_headers={"If-None-Match": '"v1"'}
+    )
+    datasette = create_datasette()
+    database_dir = pathlib.Path(
+        datasette.plugin_config("datasette-load")["database_directory"]
+    )
+
+    for i in range(2):
+        response = await datasette.client.post(
+            "/-/load",
+            json={"url": db_url, "name": "data"},
+            cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+        )
+        status_data = await wait_until_done(datasette, response.json()["id"])
+        assert status_data["error"] is None
+        assert json.loads((database_dir / "data.db.etag").read_text()) == {
+            "url": db_url,
+            "etag": '"v1"',
+        }
+
+    # Second job was not downloaded again
+    assert status_data["done_bytes"] == 0
+    assert "If-None-Match" not in httpx_mock.get_requests()[0].headers
+    assert httpx_mock.get_requests()[1].headers["If-None-Match"] == '"v1"'
+    result = await datasette.get_database("data").execute("select * from test_table")
+    assert len(result.rows) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("second_load", ("different_url", "expected_sha256"))
+async def test_etag_not_sent(httpx_mock, second_load):
+    first_db_path = create_temp_sqlite_db({"test_table": [{"id": 1}]})
+    second_db_path = create_temp_sqlite_db({"test_table": [{"id": 1}, {"id": 2}]})
+    first_url = "https://example.com/first.db"
+    second_url = (
+        "https://example.com/second.db" if second_load == "different_url" else first_url
+    )
+    second_content = open(second_db_path, "rb").read()
+    httpx_mock.add_response(
+        url=first_url,
+        content=open(first_db_path, "rb").read(),
+        headers={"ETag": '"v1"'},
+    )
+    # Would wrongly keep the first database if the ETag were sent
+    httpx_mock.add_response(
+        url=second_url,
+        status_code=304,
+        match_headers={"If-None-Match": '"v1"'},
+        is_optional=True,
+    )
+    httpx_mock.add_response(url=second_url, content=second_content)
+    datasette = create_datasette()
+    second_body = {"url": second_url, "name": "data"}
+    if second_load == "expected_sha256":
+        second_body["sha256"] = hashlib.sha256(second_content).hexdigest()
+
+    for body in ({"url": first_url, "name": "data"}, second_body):
+        response = await datasette.client.post(
+            "/-/load",
+            json=body,
+            cookies={"ds_actor": datasette.client.actor_cookie({"id": "user"})},
+        )
+        status_data = await wait_until_done(datasette, response.json()["id"])
+        assert status_data["error"] is None
+
+    assert "If-None-Match" not in httpx_mock.get_requests()[1].headers
+    assert status_data["done_bytes"] == len(second_content)
+    result = await datasette.get_database("data").execute("select * from test_table")
+    assert len(result.rows) == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_to_file_stops_after_write_error(monkeypatch, tmp_path):
+    def broken_write_buffers(f, buffers, hasher=None):
+        raise OSError("Disk full")
+
+    monkeypatch.setattr(datasette_load, "write_buffers", broken_write_buffers)
+    pieces_read = 0
+
+    async def stream():
+        nonlocal pieces_read
+        for _ in range(1000):
+            pieces_read += 1
+            yield b"x" * 10
+            await asyncio.sleep(0)
+
+    async def report_progress(nbytes, final=False):
+        pass
+
+    response = httpx.Response(200, content=stream())
+    with pytest.raises(OSError, match="Disk full"):
+        await datasette_load.stream_to_file(
+            response, tmp_path / "out.db", 10, report_progress
+        )
+    assert pieces_read < 100
+
+
+@pytest.mark.asyncio
+async def test_cancelled_download_removes_staging_file(tmp_path):
+    started = asyncio.Event()
+
+    async def stream():
+        yield b"x" * 1024
+        started.set()
+        await asyncio.Event().wait()
+
+    def handler(request):
+        return httpx.Response(
+            200, content=stream(), headers={"Content-Length": str(1024 * 1024)}
+        )
+
+    async def progress_callback(bytes_so_far, total_bytes):
+        pass
+
+    async def complete_callback(name, database_dir, error, sha256):
+        pass
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        task = asyncio.create_task(
+            download_sqlite_db(
+                url="https://example.com/data.db",
+                name="data",
+                staging_dir=tmp_path / "staging",
+                database_dir=tmp_path / "database",
+                enable_wal=False,
+                progress_callback=progress_callback,
+                complete_callback=complete_callback,
+                client=client,
+            )
+        )
+        await asyncio.wait_for(started.wait(), timeout=5)
+        assert list((tmp_path / "staging").iterdir())
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    assert not list((tmp_path / "staging").iterdir())
+
+
+@pytest.mark.asyncio
+async def test_shutdown_stops_workers():
+    datasette = create_datasette()
+    await datasette.invoke_startup()
+    workers = datasette._load_workers
+    await datasette_load.shutdown(datasette)()
+    assert all(worker.done() for worker in workers)
+    assert datasette._load_client.is_closed